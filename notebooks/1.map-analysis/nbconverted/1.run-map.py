@@ -26,13 +26,16 @@
 # In[1]:
 
 
+import itertools
 import json
+import os
 import pathlib
 import sys
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pandas as pd
-from pycytominer.cyto_utils import load_profiles
 from tqdm import TqdmWarning
 
 sys.path.append("../../")
@@ -48,10 +51,10 @@ warnings.filterwarnings("ignore", category=RuntimeWarning)
 # In[2]:
 
 
-def update_control_pathways(cell_type:str, treatment:str, pathway:str|None) -> str:
+def update_control_pathways(cell_types: pd.Series, treatments: pd.Series, pathways: pd.Series) -> pd.Series:
     """ Updates the Metadata Pathway column based on the cell type, treatment, and pathway.
 
-    This function maps the pathway information for each sample based on specific rules:
+    This function maps the pathway information for all samples at once based on specific rules:
     - If the cell type is "healthy" and the treatment is "DMSO", the pathway is labeled as "DMSO-positive".
     - If the cell type is "failing" and the treatment is "DMSO", the pathway is labeled as "DMSO-negative".
     - If the treatment is not "DMSO" and the pathway is None or NaN, the pathway is labeled as "No Pathway".
@@ -59,29 +62,86 @@ def update_control_pathways(cell_type:str, treatment:str, pathway:str|None) -> s
 
     Parameters
     ----------
-    cell_type : str
-        The type of the cell (e.g., "healthy", "failing").
-    treatment : str
-        The treatment applied to the cell (e.g., "DMSO", "UCD-0159256").
-    pathway : str | None
-        The pathway associated with the cell, or None/NaN if not available.
+    cell_types : pd.Series
+        The type of each cell (e.g., "healthy", "failing").
+    treatments : pd.Series
+        The treatment applied to each cell (e.g., "DMSO", "UCD-0159256").
+    pathways : pd.Series
+        The pathway associated with each cell, or None/NaN if not available.
 
     Returns
     -------
-    str
-        The updated pathway label based on the provided rules.
+    pd.Series
+        The updated pathway labels based on the provided rules, aligned with the
+        index of the given pathways.
     """
-    # Check if the cell type is "healthy" and treatment is "DMSO"
-    if cell_type == "healthy" and treatment == "DMSO":
-        return "DMSO-positive"
-    # Check if the cell type is "failing" and treatment is "DMSO"
-    elif cell_type == "failing" and treatment == "DMSO":
-        return "DMSO-negative"
-    # Check if the treatment is not "DMSO" and pathway is None/NaN
-    elif treatment != "DMSO" and (pathway is None or pd.isna(pathway)):
-        return "No Pathway"
-    # Return the original pathway if no conditions are met
-    return pathway
+    # boolean masks of all rules, evaluated over whole columns instead of row by row
+    cell_types = cell_types.to_numpy()
+    is_dmso = treatments.to_numpy() == "DMSO"
+    conditions = [
+        # cell type is "healthy" and treatment is "DMSO"
+        is_dmso & (cell_types == "healthy"),
+        # cell type is "failing" and treatment is "DMSO"
+        is_dmso & (cell_types == "failing"),
+        # treatment is not "DMSO" and pathway is None/NaN
+        ~is_dmso & pathways.isna().to_numpy(),
+    ]
+    labels = ["DMSO-positive", "DMSO-negative", "No Pathway"]
+
+    # keep the original pathway if no conditions are met
+    return pd.Series(
+        np.select(conditions, labels, default=pathways.to_numpy()), index=pathways.index
+    )
+
+
+def load_and_annotate_plate(
+    plate_file_path: pathlib.Path,
+    plate_barcode: str,
+    plate_name: str,
+    shared_cols: list[str],
+) -> pd.DataFrame:
+    """ Loads an aggregated plate and annotates it with its plate information.
+
+    The plate is loaded with only the shared columns and is annotated in the same step,
+    so no unannotated copy of the plate is kept in memory. This allows to load and
+    annotate multiple plates in parallel threads.
+
+    Parameters
+    ----------
+    plate_file_path : pathlib.Path
+        Path pointing to the aggregated plate parquet file.
+    plate_barcode : str
+        The barcode of the plate.
+    plate_name : str
+        The name of the plate.
+    shared_cols : list[str]
+        The columns shared across all aggregated plates.
+
+    Returns
+    -------
+    pd.DataFrame
+        The annotated aggregated plate with the plate barcode and name columns placed
+        before the shared columns.
+    """
+    # load only the shared columns of the aggregated plate
+    aggregated_data = io_utils.load_profile_columns(plate_file_path, columns=shared_cols)
+
+    # add new columns indicating the source plate barcode and name for each row, both
+    # columns are built together and placed at the front with a single concatenation
+    plate_columns = pd.DataFrame(
+        {"Metadata_plate_barcode": plate_barcode, "Metadata_plate_name": plate_name},
+        index=aggregated_data.index,
+    )
+    aggregated_data = pd.concat([plate_columns, aggregated_data], axis=1, copy=False)
+
+    # Update Metadata_Pathway column with vectorized column operations
+    aggregated_data["Metadata_Pathway"] = update_control_pathways(
+        aggregated_data["Metadata_cell_type"],
+        aggregated_data["Metadata_treatment"],
+        aggregated_data["Metadata_Pathway"],
+    )
+
+    return aggregated_data
 
 
 # This code sets up the necessary file paths and directories required for the notebook, ensuring that input files exist.
@@ -94,7 +154,7 @@ def update_control_pathways(cell_type:str, treatment:str, pathway:str|None) -> s
 main_results_dir = pathlib.Path("./results/").resolve(strict=True)
 data_dir = pathlib.Path("../data/").resolve(strict=True)
 agg_data_dir = (data_dir / "aggregated_profiles").resolve(strict=True)
-fs_profiles_paths = list((data_dir / "aggregated_profiles").resolve(strict=True).glob("*.parquet"))
+fs_profiles_paths = list(agg_data_dir.glob("*.parquet"))
 
 # Setting the metadata directory for updated plate maps and ensure it exists
 metadata_dir = pathlib.Path("../data/metadata/updated_platemaps").resolve(strict=True)
@@ -120,8 +180,12 @@ configs = io_utils.load_config(config_path)
 general_configs = configs["general_configs"]
 plate_name_lookup = general_configs["plate_name_lookup"]
 
-# loading bar code
-barcode = pd.read_csv(platemap_path)
+# loading bar code, only the plate barcode and platemap file columns are parsed
+barcode = pd.read_csv(
+    platemap_path,
+    usecols=["plate_barcode", "platemap_file"],
+    dtype={"plate_barcode": str, "platemap_file": "category"},
+)
 
 
 # Since these files have undergone feature selection, it is essential to identify the overlapping feature names to ensure accurate and consistent analysis.
@@ -160,50 +224,65 @@ print(len(shared_cols))
 # suffix for aggregated profiles
 aggregated_file_suffix = "aggregated_post_fs.parquet"
 
+# set the file paths of all aggregated plates, then load and annotate them in parallel
+# threads, since pyarrow releases the GIL while reading and decoding the parquet files.
+# Only the shared columns are decoded, the remaining columns are never read. The paths
+# are not resolved beforehand since opening a missing file raises a FileNotFoundError
+plate_file_paths = {
+    plate_barcode: agg_data_dir / f"{plate_barcode}_{aggregated_file_suffix}"
+    for plate_barcode in barcode["plate_barcode"].unique()
+}
+# os.cpu_count() can return None and ThreadPoolExecutor rejects zero workers
+n_workers = max(1, min(len(plate_file_paths), os.cpu_count() or 1))
+with ThreadPoolExecutor(max_workers=n_workers) as executor:
+    loaded_aggregated_data = dict(
+        zip(
+            plate_file_paths.keys(),
+            # the arguments are passed as parallel iterables instead of capturing them in
+            # a lambda, so the mapped function stays picklable for process pools
+            executor.map(
+                load_and_annotate_plate,
+                plate_file_paths.values(),
+                plate_file_paths.keys(),
+                [
+                    plate_name_lookup["batch_1"].get(plate_barcode, np.nan)
+                    for plate_barcode in plate_file_paths
+                ],
+                itertools.repeat(shared_cols),
+            ),
+        )
+    )
+
+# ensure that every platemap CSV file referenced in the barcode file exists, each
+# platemap is only checked once even when it is shared across batches. Their contents
+# are not parsed since the aggregated profiles already contain the platemap metadata
+platemap_file_paths = {
+    platemap_filename: (metadata_dir / f"{platemap_filename}.csv").resolve(strict=True)
+    for platemap_filename in barcode["platemap_file"].unique()
+}
+
 # dictionary to store loaded plate data grouped by batch
 loaded_plate_batches = {}
 loaded_shuffled_plate_batches = {}
 
+# collect the plate barcodes associated with each platemap file in a single groupby
+platemap_plate_barcodes = barcode.groupby("platemap_file", observed=True)["plate_barcode"].agg(list)
+
 # iterate over unique platemap files and their associated plates
-for batch_index, (platemap_filename, associated_plates_df) in enumerate(
-    barcode.groupby("platemap_file")
+for batch_index, (platemap_filename, plate_barcodes) in enumerate(
+    platemap_plate_barcodes.items()
 ):
     # generate a unique batch ID
     batch_id = f"batch_{batch_index + 1}"
 
-    # load the platemap CSV file
-    platemap_path = (metadata_dir / f"{platemap_filename}.csv").resolve(strict=True)
-    platemap_data = pd.read_csv(platemap_path)
-
-    # extract all plate names associated with the current platemap
-    plate_barcodes = associated_plates_df["plate_barcode"].tolist()
-
     # list to store all loaded and processed aggregated plates for the current batch
     loaded_aggregated_plates = []
     loaded_shuffled_aggregated_plates = []
 
     for plate_barcode in plate_barcodes:
-        # resolve the file path for the aggregated plate data
-        plate_file_path = (
-            agg_data_dir / f"{plate_barcode}_{aggregated_file_suffix}"
-        ).resolve(strict=True)
-
-        # load the aggregated profile data for the current plate
-        aggregated_data = load_profiles(plate_file_path)
-
-        # update loaded data frame with only shared features
-        aggregated_data = aggregated_data[shared_cols]
-
-        # add a new column indicating the source plate for each row
-        aggregated_data.insert(0,"Metadata_plate_barcode" , plate_barcode)
-
-        # Add plate name
-        aggregated_data.insert(1, "Metadata_plate_name", aggregated_data["Metadata_plate_barcode"].map(plate_name_lookup["batch_1"]))
-
-        # Update Metadata_Pathway column
-        aggregated_data["Metadata_Pathway"] = aggregated_data.apply(
-            lambda row: update_control_pathways(row["Metadata_cell_type"], row["Metadata_treatment"], row["Metadata_Pathway"]), axis=1
-        )
+        # take the loaded and annotated aggregated profile data for the current plate,
+        # it is removed from the loaded plates so it is released once the batch is combined
+        aggregated_data = loaded_aggregated_data.pop(plate_barcode)
 
         # append the processed aggregated data for this plate to the batch list
         loaded_aggregated_plates.append(aggregated_data)
@@ -215,12 +294,12 @@ for batch_index, (platemap_filename, associated_plates_df) in enumerate(
         loaded_shuffled_aggregated_plates.append(shuffled_aggregated_data)
 
     # combine all processed plates for the current batch into a single DataFrame
-    combined_aggregated_data = pd.concat(loaded_aggregated_plates).reset_index(drop=True)
+    combined_aggregated_data = pd.concat(loaded_aggregated_plates, ignore_index=True, copy=False)
     meta_concat, feats_concat = data_utils.split_meta_and_features(combined_aggregated_data)
 
     # combine all shuffled and processed plates for the current batch into a single DataFrame
     # shuffled_combined_aggregated_data = pd.concat(loaded_shuffled_aggregated_plates).reset_index().rename(columns={"index": "Metadata_old_index"})
-    shuffled_combined_aggregated_data = pd.concat(loaded_shuffled_aggregated_plates).reset_index(drop=True)
+    shuffled_combined_aggregated_data = pd.concat(loaded_shuffled_aggregated_plates, ignore_index=True, copy=False)
     meta_concat, feats_concat = data_utils.split_meta_and_features(shuffled_combined_aggregated_data)
 
     # store the combined DataFrame in the loaded_plate_batches dictionary
@@ -8,37 +8,65 @@
 
 
 import pathlib
+import sys
 
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import seaborn as sns
 
+sys.path.append("../../")
+from utils import data_utils
+
+# figure saving settings shared by all saved plots
+plt.rcParams["savefig.dpi"] = 300
+plt.rcParams["savefig.bbox"] = "tight"
+
+# PNG compression level used when saving plots, lower levels save faster with
+# slightly larger files
+png_save_kwargs = {"compress_level": 1}
+
 # Setting helper functions
 
 # In[2]:
 
 
-def rename_map_columns(map_df, prefix):
-    """Renames mAP score columns with a specified prefix (negative or positive).
+def load_map_scores(map_path, columns, dtypes, cache_dir):
+    """Loads selected columns of a mAP score file, preferring a Parquet copy of the CSV.
+
+    If a Parquet copy of the CSV file exists in the cache directory and is not older
+    than the CSV file, the columns are read from the Parquet file. Otherwise, the whole
+    CSV file is parsed and copied to Parquet so that subsequent runs can skip parsing,
+    regardless of the columns they select.
 
     Parameters
     ----------
-    map_df : pandas.DataFrame
-        DataFrame containing mAP scores.
-    prefix : str
-        Prefix to add to the column names (e.g., 'negative' or 'positive').
+    map_path : pathlib.Path
+        Path pointing to the mAP score CSV file.
+    columns : list[str]
+        Columns to load from the mAP score file.
+    dtypes : dict
+        Dtypes applied to the selected columns.
+    cache_dir : pathlib.Path
+        Directory where the Parquet copies of the CSV files are stored.
 
     Returns
     -------
     pandas.DataFrame
-        DataFrame with renamed columns.
+        DataFrame containing only the selected columns.
     """
-    return map_df.rename(
-        columns={
-            "mean_average_precision": f"{prefix}_mean_average_precision",
-            "corrected_p_value": f"{prefix}_corrected_p_value",
-        }
-    )
+    parquet_path = cache_dir / map_path.with_suffix(".parquet").name
+    if (
+        parquet_path.exists()
+        and parquet_path.stat().st_mtime >= map_path.stat().st_mtime
+    ):
+        map_df = pd.read_parquet(parquet_path, columns=columns, engine="pyarrow")
+    else:
+        map_df = pd.read_csv(map_path)
+        map_df.to_parquet(parquet_path, index=False, engine="pyarrow")
+        map_df = map_df[columns]
+
+    return map_df.astype(dtypes)
 
 
 def calculate_delta_map(map_df):
@@ -47,23 +75,31 @@ def calculate_delta_map(map_df):
     Parameters
     ----------
     map_df : pandas.DataFrame
-        DataFrame containing mAP scores with 'negative_mean_average_precision' and
-        'positive_mean_average_precision' columns.
+        DataFrame containing mAP scores with 'mean_average_precision_negative' and
+        'mean_average_precision_positive' columns.
 
     Returns
     -------
     pandas.DataFrame
         DataFrame with an additional 'delta_mAP' column.
     """
-    map_df["delta_mAP"] = (
-        map_df["negative_mean_average_precision"]
-        - map_df["positive_mean_average_precision"]
+    # subtracting the underlying arrays skips pandas index alignment, the subtraction
+    # is done in double precision so the written delta mAP scores carry no rounding noise
+    negative_map = map_df["mean_average_precision_negative"].to_numpy(
+        dtype=np.float64, copy=False
     )
+    positive_map = map_df["mean_average_precision_positive"].to_numpy(
+        dtype=np.float64, copy=False
+    )
+    map_df["delta_mAP"] = negative_map - positive_map
     return map_df
 
 
 def add_pathway_info(map_df, pathway_df):
-    """Merges pathway information into the dataframe and removes the 'UCD ID' column.
+    """Adds a 'Pathway' column by looking up each treatment in the pathway information.
+
+    Treatments that are not found in the pathway information are dropped, which
+    mirrors an inner join on 'UCD ID'.
 
     Parameters
     ----------
@@ -75,11 +111,14 @@ def add_pathway_info(map_df, pathway_df):
     Returns
     -------
     pandas.DataFrame
-        DataFrame with merged pathway information.
+        DataFrame with an additional 'Pathway' column.
     """
-    return map_df.merge(
-        pathway_df, left_on="Metadata_treatment", right_on="UCD ID", how="inner"
-    ).drop(columns="UCD ID")
+    # 'UCD ID' must be unique, otherwise the lookup below raises an error
+    pathway_lookup = pathway_df.set_index("UCD ID")["Pathway"]
+
+    map_df = map_df.loc[map_df["Metadata_treatment"].isin(pathway_lookup.index)].copy()
+    map_df["Pathway"] = map_df["Metadata_treatment"].map(pathway_lookup)
+    return map_df
 
 
 def filter_ref_control(map_df, ref_type, control_type, value_column):
@@ -156,6 +195,11 @@ map_analysis_results_dir.mkdir(exist_ok=True)
 fig_dir_path = (map_analysis_results_dir / "figures").resolve()
 fig_dir_path.mkdir(exist_ok=True)
 
+# directory of the Parquet copies of the mAP score files, which is kept outside of the
+# results directory since it only holds intermediate files
+map_scores_cache_dir = pathlib.Path("./cache/map_scores").resolve()
+map_scores_cache_dir.mkdir(exist_ok=True, parents=True)
+
 # pathway informaiton
 pathway_info = pathlib.Path(
     "../data/metadata/original_platemaps/pathways_platemap.csv"
@@ -177,13 +221,17 @@ pathway_info = pathlib.Path(
 # In[4]:
 
 
+# scores are kept in double precision, so the delta mAP scores and their ranks match
+# the values computed from the CSV files
+score_dtypes = {"mean_average_precision": np.float64, "corrected_p_value": np.float64}
+
 # Load the original mAP scores
-negref_mAP_df = pd.read_csv(negref_mAP_scores_path)
-posref_mAP_df = pd.read_csv(positive_mAP_scores_path)
+negref_mAP_df = pd.read_csv(negref_mAP_scores_path, dtype=score_dtypes)
+posref_mAP_df = pd.read_csv(positive_mAP_scores_path, dtype=score_dtypes)
 
 # Load the shuffled mAP scores
-shuffled_negref_map_df = pd.read_csv(shuffled_negref_mAP_scores_path)
-shuffled_posref_map_df = pd.read_csv(shuffled_posref_mAP_scores_path)
+shuffled_negref_map_df = pd.read_csv(shuffled_negref_mAP_scores_path, dtype=score_dtypes)
+shuffled_posref_map_df = pd.read_csv(shuffled_posref_mAP_scores_path, dtype=score_dtypes)
 
 # Rename the 'mean_average_precision' column to 'positive_ref_mAP' and 'negative_ref_mAP'
 negref_mAP_df = negref_mAP_df.rename(
@@ -290,8 +338,8 @@ dmso_map_df = pd.concat([original_dmso_map_df, shuffled_dmso_map_df]).rename(
 cols = [
     "Metadata_treatment",
     "Pathway",
-    "negative_mean_average_precision",
-    "positive_mean_average_precision",
+    "mean_average_precision_negative",
+    "mean_average_precision_positive",
     "delta_mAP",
     "shuffled",
 ]
@@ -315,8 +363,8 @@ dmso_map_df["delta_mAP"] = (
 dmso_map_df = dmso_map_df.rename(
     columns={
         "Metadata_target_control_type": "Metadata_treatment",
-        "negative_ref_mAP": "negative_mean_average_precision",
-        "positive_ref_mAP": "positive_mean_average_precision",
+        "negative_ref_mAP": "mean_average_precision_negative",
+        "positive_ref_mAP": "mean_average_precision_positive",
     }
 )
 dmso_map_df = dmso_map_df[cols]
@@ -328,31 +376,51 @@ dmso_map_df
 # In[7]:
 
 
-# columns that we are interested in
+# columns that we are interested in and their dtypes
+# only these columns are loaded from the score files
 interested_cols = ["Metadata_treatment", "mean_average_precision", "corrected_p_value"]
+interested_dtypes = {
+    "Metadata_treatment": "category",
+    "mean_average_precision": np.float64,
+    "corrected_p_value": np.float64,
+}
 
 # loading in the pathway information for each treatment
-pathway_df = pd.read_csv(pathway_info)[["UCD ID", "Pathway"]]
+# both columns are low-cardinality labels, so they are loaded as categoricals
+pathway_df = pd.read_csv(pathway_info, usecols=["UCD ID", "Pathway"], dtype="category")
 
 # treatment mAP scores generated from original data
-nc_map_df = pd.read_csv(nc_dmso_map_path)[interested_cols]
-pc_map_df = pd.read_csv(pc_dmso_map_path)[interested_cols]
+nc_map_df = load_map_scores(
+    nc_dmso_map_path, interested_cols, interested_dtypes, map_scores_cache_dir
+)
+pc_map_df = load_map_scores(
+    pc_dmso_map_path, interested_cols, interested_dtypes, map_scores_cache_dir
+)
 
 # treatment mAP scores generated from shuffled data
-shuffled_nc_map_df = pd.read_csv(shuffled_nc_dmso_map_path)[interested_cols]
-shuffled_pc_map_df = pd.read_csv(shuffled_pc_dmso_map_path)[interested_cols]
-
-# rename columns for mAP scores generated from both original and shuffled
-nc_map_df = rename_map_columns(nc_map_df, "negative")
-pc_map_df = rename_map_columns(pc_map_df, "positive")
-shuffled_nc_map_df = rename_map_columns(shuffled_nc_map_df, "negative")
-shuffled_pc_map_df = rename_map_columns(shuffled_pc_map_df, "positive")
+shuffled_nc_map_df = load_map_scores(
+    shuffled_nc_dmso_map_path, interested_cols, interested_dtypes, map_scores_cache_dir
+)
+shuffled_pc_map_df = load_map_scores(
+    shuffled_pc_dmso_map_path, interested_cols, interested_dtypes, map_scores_cache_dir
+)
 
-# merge both together
+# merge both together, the score columns are labeled with the control used as reference
+map_suffixes = ("_negative", "_positive")
 all_shuffled_trt_map_df = shuffled_nc_map_df.merge(
-    shuffled_pc_map_df, on="Metadata_treatment", how="inner"
+    shuffled_pc_map_df,
+    on="Metadata_treatment",
+    how="inner",
+    suffixes=map_suffixes,
+    validate="one_to_one",
+)
+all_trt_map_df = nc_map_df.merge(
+    pc_map_df,
+    on="Metadata_treatment",
+    how="inner",
+    suffixes=map_suffixes,
+    validate="one_to_one",
 )
-all_trt_map_df = nc_map_df.merge(pc_map_df, on="Metadata_treatment", how="inner")
 
 # checking if none of the data has been dropped after
 all_merged_df_rows = all_trt_map_df.shape[0]
@@ -391,8 +459,8 @@ all_trt_map_df = all_trt_map_df[
     [
         "Metadata_treatment",
         "Pathway",
-        "negative_mean_average_precision",
-        "positive_mean_average_precision",
+        "mean_average_precision_negative",
+        "mean_average_precision_positive",
         "delta_mAP",
         "shuffled",
     ]
@@ -424,11 +492,17 @@ all_map_df.head()
 # In[9]:
 
 
+# maximum number of non-shuffled treated wells drawn as individual markers, larger
+# screens are drawn as a hexbin density plot of only the non-shuffled wells since the
+# number of drawn markers dominates plotting time
+max_scatter_points = 1000
+
 # Separate the data into two subsets: DMSO-positive and DMSO-negative vs. the rest
 dmso_positive_negative = all_map_df[
     all_map_df["Pathway"].str.contains("DMSO", na=False)
 ]
 other_pathways = all_map_df[~all_map_df["Pathway"].str.contains("DMSO", na=False)]
+original_other_pathways = other_pathways[~other_pathways["shuffled"]]
 
 # Create subplots
 fig, axes = plt.subplots(1, 2, figsize=(18, 8), sharex=True, sharey=True)
@@ -436,8 +510,8 @@ fig, axes = plt.subplots(1, 2, figsize=(18, 8), sharex=True, sharey=True)
 # Plot DMSO-positive & DMSO-negative
 sns.scatterplot(
     data=dmso_positive_negative,
-    x="negative_mean_average_precision",
-    y="positive_mean_average_precision",
+    x="mean_average_precision_negative",
+    y="mean_average_precision_positive",
     hue="Pathway",
     style="shuffled",
     markers={True: "^", False: "o"},
@@ -470,19 +544,32 @@ if dmso_legend is not None:
         text.set_fontsize(12)
 
 # Plotting the mAP scores of treated wells
-sns.scatterplot(
-    data=other_pathways,
-    x="negative_mean_average_precision",
-    y="positive_mean_average_precision",
-    style="shuffled",
-    markers={True: "^", False: "o"},
-    hue="Pathway",
-    palette="tab20",
-    ax=axes[1],
-    s=110,
-    edgecolor="black",
-    alpha=0.8,
-)
+plot_trt_density = original_other_pathways.shape[0] >= max_scatter_points
+if not plot_trt_density:
+    sns.scatterplot(
+        data=other_pathways,
+        x="mean_average_precision_negative",
+        y="mean_average_precision_positive",
+        style="shuffled",
+        markers={True: "^", False: "o"},
+        hue="Pathway",
+        palette="tab20",
+        ax=axes[1],
+        s=110,
+        edgecolor="black",
+        alpha=0.8,
+    )
+else:
+    # the shuffled wells are left out so the density only reflects the original wells
+    trt_hexbin = axes[1].hexbin(
+        original_other_pathways["mean_average_precision_negative"],
+        original_other_pathways["mean_average_precision_positive"],
+        gridsize=40,
+        extent=(0, 1.02, 0, 1.02),
+        mincnt=1,
+        cmap="viridis",
+    )
+    fig.colorbar(trt_hexbin, ax=axes[1], label="Number of non-shuffled treated wells")
 
 
 # Updating axes values
@@ -498,26 +585,28 @@ axes[1].set_title("Treated wells mAP scores", fontsize=14)
 axes[1].tick_params(axis="both", which="major", labelsize=14)
 
 
-# Remove the default legend and add a new one
-axes[1].legend_.remove()
-axes[1].legend(
-    loc="upper center",
-    bbox_to_anchor=(1.15, 1),
-    fancybox=True,
-    ncol=1,
-)
+# the hexbin density plot has no pathway legend
+if not plot_trt_density:
+    # Remove the default legend and add a new one
+    axes[1].legend_.remove()
+    axes[1].legend(
+        loc="upper center",
+        bbox_to_anchor=(1.15, 1),
+        fancybox=True,
+        ncol=1,
+    )
 
-# Adjust the legend position
-axes[1].legend_.set_bbox_to_anchor((1.20, .8))
-trt_map_legend = axes[1].legend_
-if trt_map_legend is not None:
-    trt_map_legend.set_title("Pathways", prop={"size": 14})
-    for text in trt_map_legend.get_texts():
-        text.set_fontsize(12)
+    # Adjust the legend position
+    axes[1].legend_.set_bbox_to_anchor((1.20, .8))
+    trt_map_legend = axes[1].legend_
+    if trt_map_legend is not None:
+        trt_map_legend.set_title("Pathways", prop={"size": 14})
+        for text in trt_map_legend.get_texts():
+            text.set_fontsize(12)
 
 
-# Adjust the legend title size for only axes[1]:
-trt_map_legend.set_title("Pathways", prop={"size": 14})  # Increase legend title size
+    # Adjust the legend title size for only axes[1]:
+    trt_map_legend.set_title("Pathways", prop={"size": 14})  # Increase legend title size
 
 # Adjust layout and add a main title
 fig.suptitle("mAP scores: negative vs. positive controls", fontsize=20, y=1.05)
@@ -526,7 +615,7 @@ fig.suptitle("mAP scores: negative vs. positive controls", fontsize=20, y=1.05)
 plt.tight_layout()
 
 # Save the figure
-plt.savefig(fig_dir_path / "map_scores_separated.png", dpi=300, bbox_inches="tight")
+plt.savefig(fig_dir_path / "map_scores_separated.png", pil_kwargs=png_save_kwargs)
 
 # Show the plot
 plt.show()
@@ -620,7 +709,7 @@ plt.tight_layout()
 
 
 # save plot
-plt.savefig(fig_dir_path / "delta_mAP_histogram.png", dpi=300, bbox_inches="tight")
+plt.savefig(fig_dir_path / "delta_mAP_histogram.png", pil_kwargs=png_save_kwargs)
 
 # Show the plot
 plt.show()
@@ -660,7 +749,7 @@ plt.tight_layout()
 
 
 # save plot
-plt.savefig(fig_dir_path / "shuffled_delta_mAP_histogram.png", dpi=300, bbox_inches="tight")
+plt.savefig(fig_dir_path / "shuffled_delta_mAP_histogram.png", pil_kwargs=png_save_kwargs)
 
 # Show the plot
 plt.show()
@@ -682,9 +771,8 @@ delta_map_df = delta_map_df[
     ~delta_map_df["Pathway"].str.contains("DMSO-positive|DMSO-negative", na=False)
 ]
 
-# Add ranks to the DataFrame
-delta_map_df["rank"] = delta_map_df["delta_mAP"].rank(ascending=True, method="max")
-delta_map_df = delta_map_df.sort_values(by="rank", ascending=False)
+# Add ranks to the DataFrame and sort it from the highest to the lowest rank
+delta_map_df = data_utils.sort_by_rank(delta_map_df, "delta_mAP")
 
 # creating scatter plot of all Delta mAP score ranks
 sns.scatterplot(
@@ -713,7 +801,7 @@ plt.legend(loc="upper left")
 delta_map_df.to_csv(map_analysis_results_dir / "ranked_delta_mAPs.csv", index=False)
 
 # save plot
-plt.savefig(fig_dir_path / "delta_mAP_rankings.png", dpi=300, bbox_inches="tight")
+plt.savefig(fig_dir_path / "delta_mAP_rankings.png", pil_kwargs=png_save_kwargs)
 
 # display plot
 plt.show()
@@ -732,9 +820,8 @@ delta_map_df = all_map_df.loc[all_map_df["shuffled"]][["Metadata_treatment", "de
 delta_map_df = delta_map_df[
     ~delta_map_df["Pathway"].str.contains("DMSO-positive|DMSO-negative", na=False)]
 
-# Add ranks to the DataFrame
-delta_map_df["rank"] = delta_map_df["delta_mAP"].rank(ascending=True, method="max")
-delta_map_df = delta_map_df.sort_values(by="rank", ascending=False)
+# Add ranks to the DataFrame and sort it from the highest to the lowest rank
+delta_map_df = data_utils.sort_by_rank(delta_map_df, "delta_mAP")
 
 # creating scatter plot of all Delta mAP score ranks
 sns.scatterplot(
@@ -763,7 +850,7 @@ plt.legend(loc="upper left")
 delta_map_df.to_csv(map_analysis_results_dir / "shuffled_ranked_delta_mAPs.csv", index=False)
 
 # save plot
-plt.savefig(fig_dir_path / "shuffled_delta_mAP_rankings.png", dpi=300, bbox_inches="tight")
+plt.savefig(fig_dir_path / "shuffled_delta_mAP_rankings.png", pil_kwargs=png_save_kwargs)
 
 # display plot
 plt.show()
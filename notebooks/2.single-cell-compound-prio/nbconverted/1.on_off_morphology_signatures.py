@@ -32,7 +32,6 @@ import sys
 
 import numpy as np
 import pandas as pd
-import pyarrow.parquet as pq
 from scipy.stats import ks_2samp
 from statsmodels.stats.multitest import multipletests
 
@@ -176,58 +175,6 @@ def weighted_ks_test(
 
     return off_morphology_signatures, on_morphology_signatures
 
-def find_shared_features(profile_paths: list[str | pathlib.Path]) -> list[str]:
-    """ Find the shared features (columns) between the profiles in the provided list of
-    file paths, while retaining the order of features as they appear in the first
-    profile.
-
-    This function leverages the schema information from the Parquet files to extract the
-    the columns names without loading in the entire dataset. The first profile is used
-    as the reference for the order of features. Then, the function iterates through the
-    remaining profiles to find the common features. If no common features are found, an
-    empty list is returned.
-
-    Parameters
-    ----------
-    profile_paths : list[str | pathlib.Path]
-        A list of file paths pointing to the Parquet profile files.
-
-    Returns
-    -------
-    list[str]
-        A list of features (column names) that are common across all profiles, retaining the order
-        from the first profile.
-
-    Raises
-    ------
-    ValueError
-        If any of the profile paths do not point to Parquet files.
-    """
-    # type checker to check if the file provided are parquet files
-    for path in profile_paths:
-        if not path.suffix == ".parquet" or path.suffix == ".pq":
-            raise ValueError("All profile paths must point to Parquet files.")
-
-    # initialize the shared features to None
-    shared_features = None
-
-    # iterate through the profile paths
-    for profile_path in profile_paths:
-        # Load the metadata of the Parquet file
-        parquet_metadata = pq.ParquetFile(profile_path)
-
-        # Extract column names from the schema
-        column_names = parquet_metadata.schema.names
-
-        if shared_features is None:
-            # Initialize shared features on the first iteration
-            shared_features = column_names
-        else:
-            # Retain only the features that are shared, keeping their order
-            shared_features = [name for name in shared_features if name in column_names]
-
-    return shared_features if shared_features else []
-
 
 # ## Applying weighted KS to the CFReT dataset
 
@@ -256,7 +203,8 @@ morph_signatures_dir.mkdir(exist_ok=True)
 # In[4]:
 
 
-shared_features = find_shared_features(selected_features_files)
+# finding the shared features with the project utils
+shared_features = data_utils.find_shared_features(selected_features_files)
 
 # loading all single-cell profiles and updating it with the shared features
 loaded_profiles_df = []
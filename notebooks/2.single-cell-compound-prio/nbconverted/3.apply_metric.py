@@ -5,21 +5,23 @@
 # In[1]:
 
 
+import functools
 import json
+import os
 import pathlib
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from itertools import product
 
 import numpy as np
 import pandas as pd
-from pycytominer.cyto_utils import load_profiles
 from scipy.stats import entropy
 from sklearn.impute import SimpleImputer
 from sklearn.preprocessing import MinMaxScaler
 
 # importing analysis utils
 sys.path.append("../../utils")
-from utils import data_utils
+from utils import data_utils, io_utils
 
 # ## helper functions
 
@@ -139,7 +141,11 @@ metadata_cluster_path = (results_dir / "cluster/metadata_w_clusters.csv").resolv
 )
 
 # setting single-cell profile paths raise an error if no profiles are found
-profile_paths = list(data_dir.glob("*sc_feature_selected.parquet"))
+profile_paths = [
+    pathlib.Path(entry.path)
+    for entry in os.scandir(data_dir)
+    if entry.name.endswith("sc_feature_selected.parquet")
+]
 if len(profile_paths) == 0:
     raise FileNotFoundError("Profiles were not found at the given directory")
 
@@ -167,13 +173,22 @@ meta_w_cluster_info_df = pd.read_csv(metadata_cluster_path)
 # Establishing the feature space that is shared across all plates
 shared_features = data_utils.find_shared_features(profile_paths)
 
-# loading all single-cell profiles and updating it with the shared features
-loaded_profiles_df = [
-    load_profiles(single_cell_path)[shared_features]
-    for single_cell_path in profile_paths
-]
-# Concatenate all the single_cell profiles and reset index and save original shape
-all_profiles_df = pd.concat(loaded_profiles_df, axis=0).reset_index(drop=True)
+# loading all single-cell profiles with only the shared features, the remaining
+# columns are never decoded from the parquet files. Files are loaded in parallel
+# threads since pyarrow releases the GIL while reading and decoding, and the files are
+# memory mapped with pre-buffered column chunk reads
+# os.cpu_count() can return None and ThreadPoolExecutor rejects zero workers
+n_workers = max(1, min(len(profile_paths), os.cpu_count() or 1))
+with ThreadPoolExecutor(max_workers=n_workers) as executor:
+    loaded_profiles_df = list(
+        executor.map(
+            functools.partial(io_utils.load_profile_columns, columns=shared_features),
+            profile_paths,
+        )
+    )
+# Concatenate all the single_cell profiles with a fresh index and without copying
+# the blocks of the loaded profiles
+all_profiles_df = pd.concat(loaded_profiles_df, axis=0, ignore_index=True, copy=False)
 
 # split the metadata and feature columns
 all_meta, all_feats = data_utils.split_meta_and_features(all_profiles_df)
@@ -217,9 +232,10 @@ meta_cols, feat_cols = data_utils.split_meta_and_features(all_profiles_df)
 if metadata_treatments not in meta_cols:
     raise ValueError(f"{metadata_treatments} is a metadata column that does not exist")
 
-# separate the data to target and treated
-target_df = all_profiles_df.loc[all_profiles_df[metadata_treatments] == target_name]
-treated_df = all_profiles_df.loc[all_profiles_df[metadata_treatments] != target_name]
+# separate the data to target and treated with a single comparison
+is_target = all_profiles_df[metadata_treatments].to_numpy() == target_name
+target_df = all_profiles_df.iloc[is_target]
+treated_df = all_profiles_df.iloc[~is_target]
 
 # Removing the -1 cluster label
 # These clusters are known a "noisy" clusters and are not used in the analysis
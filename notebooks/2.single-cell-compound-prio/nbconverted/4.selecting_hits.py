@@ -162,17 +162,15 @@ pathway_df["UCD ID"] = pathway_df.apply(
     lambda row: update_dmso_name(row["UCD ID"], row["Cell Type"]), axis=1
 )
 
-# Select only the UCD ID and Pathway columns
-pathway_info_df = pathway_df[["UCD ID", "Pathway"]]
+# Select only the Pathway column indexed by the UCD ID, so the platemap is joined on its
+# index and the key column does not need to be merged and dropped afterwards
+pathway_info_df = pathway_df.set_index("UCD ID")[["Pathway"]]
 
-# merge the pathway info with the ranked_df
-ranked_df = ranked_df.merge(
-    pathway_info_df, left_on="treatment_name", right_on="UCD ID", how="left"
+# join the pathway info with the ranked_df, the UCD ID is not added as a column
+ranked_df = ranked_df.join(pathway_info_df, on="treatment_name", how="left").reset_index(
+    drop=True
 )
 
-# Drop the UCD ID column
-ranked_df = ranked_df.drop(columns=["UCD ID"])
-
 # display
 print(ranked_df.shape)
 ranked_df.head()
@@ -10,14 +10,18 @@
 import pathlib
 import sys
 
+import numpy as np
 import pandas as pd
-from comparators.PearsonsCorrelation import PearsonsCorrelation
-from comparison_tools.PairwiseCompareManager import PairwiseCompareManager
 from pycytominer import consensus
 from pycytominer.cyto_utils import load_profiles
 
 # loading project utils
 sys.path.append("../../../")
+from utils.analysis_utils import (
+    normalize_profiles,
+    pairwise_pearson,
+    pairwise_pearson_from_z,
+)
 from utils.data_utils import split_meta_and_features
 
 # In[2]:
@@ -42,12 +46,35 @@ agg_profile = load_profiles(data_path)
 # split the features:
 metadata, features = split_meta_and_features(agg_profile)
 
+# single precision is enough for correlations, casting the features once halves the
+# memory used by the profiles and all the arrays derived from them
+agg_profile[features] = agg_profile[features].astype(np.float32)
+
+# mean-center and L2-normalize all profiles once, each comparison below selects the
+# rows it needs from this matrix
+z_feats = normalize_profiles(agg_profile, features)
+
+# row indices used to select the profiles of each comparison, computed once from the
+# factorized treatments and reused to select rows of the metadata and normalized features
+treatment_codes, treatment_names = pd.factorize(agg_profile["Metadata_treatment"])
+is_dmso_pos = treatment_codes == treatment_names.get_loc("DMSO-positive")
+is_dmso_neg = treatment_codes == treatment_names.get_loc("DMSO-negative")
+dmso_idx = np.flatnonzero(is_dmso_pos | is_dmso_neg)
+trt_idx = np.flatnonzero(~(is_dmso_pos | is_dmso_neg))
+healthy_ref_idx = np.flatnonzero(~is_dmso_neg)
+failing_ref_idx = np.flatnonzero(~is_dmso_pos)
+
+# metadata only view of the profiles used to select the metadata of each comparison
+agg_meta = agg_profile[metadata]
+
 # now only select DMSO profiles that are DMSO_positive and DMSO-negative
-dmso_profiles = agg_profile.loc[
-    (agg_profile["Metadata_treatment"] == "DMSO-positive")
-    | (agg_profile["Metadata_treatment"] == "DMSO-negative")
-]
-dmso_profiles["Metadata_plate_well"] = dmso_profiles[["Metadata_plate_name", "Metadata_Well"]].apply(lambda row: f"{row[0]}_{row[1]}", axis=1)
+# a copy is made since the plate well column is added to the selected profiles
+dmso_profiles = agg_profile.iloc[dmso_idx].copy()
+dmso_profiles["Metadata_plate_well"] = (
+    dmso_profiles["Metadata_plate_name"].astype(str)
+    + "_"
+    + dmso_profiles["Metadata_Well"].astype(str)
+)
 
 # create a dataframe only containing pathway information and the the treatments
 pathway_df = agg_profile[["Metadata_treatment", "Metadata_Pathway"]]
@@ -67,59 +94,29 @@ pathway_df = agg_profile[["Metadata_treatment", "Metadata_Pathway"]]
 # In[4]:
 
 
-# Comparing all positive controls (healthy cells) cross all plates to see if they are similar
-dmso_pos_cntrl_comparer = PairwiseCompareManager(
-    _df=dmso_profiles.loc[dmso_profiles["Metadata_treatment"] == "DMSO-positive"],
-    _feat_cols=features,
-    _different_columns=["Metadata_plate_well"],
-    _same_columns=["Metadata_treatment"],
-    _comparator=PearsonsCorrelation(),
+# Comparing all positive controls (healthy cells) and all negative controls (unhealthy
+# cells) cross all plates to see if they are similar. Both controls are compared in a
+# single call, pairs must share the same treatment so no cross-control pairs are made
+dmso_pairwise_scores = pairwise_pearson_from_z(
+    z_feats=z_feats[dmso_idx],
+    meta=dmso_profiles,
+    different_cols=["Metadata_plate_well"],
+    same_cols=["Metadata_treatment"],
 )
 
-# collecting all pairwise scores
-pos_cntrl_pairwise_scores = dmso_pos_cntrl_comparer()
-
-
-# In[5]:
-
-
-# Comparing all negative controls (unhealthy cells) cross all plates to see if they are similar
-dmso_neg_cntrl_comparer = PairwiseCompareManager(
-    _df=dmso_profiles.loc[dmso_profiles["Metadata_treatment"] == "DMSO-negative"],
-    _feat_cols=features,
-    _different_columns=["Metadata_plate_well"],
-    _same_columns=["Metadata_treatment"],
-    _comparator=PearsonsCorrelation(),
-)
-
-# collecting all pairwise scores
-neg_cntrl_pairwise_scores = dmso_neg_cntrl_comparer()
-
 
 # In[6]:
 
 
-# concatenate the scores
-final_dmso_pairwise_scores = pd.concat(
+# selecting only relevant columns of both controls
+final_dmso_pairwise_scores = dmso_pairwise_scores[
     [
-        pos_cntrl_pairwise_scores[
-            [
-                "pearsons_correlation",
-                "Metadata_treatment__antehoc_group0",
-                "Metadata_plate_well__posthoc_group0",
-                "Metadata_plate_well__posthoc_group1",
-            ]
-        ],
-        neg_cntrl_pairwise_scores[
-            [
-                "pearsons_correlation",
-                "Metadata_treatment__antehoc_group0",
-                "Metadata_plate_well__posthoc_group0",
-                "Metadata_plate_well__posthoc_group1",
-            ]
-        ],
+        "pearsons_correlation",
+        "Metadata_treatment__antehoc_group0",
+        "Metadata_plate_well__posthoc_group0",
+        "Metadata_plate_well__posthoc_group1",
     ]
-)
+]
 
 # update the columns names
 final_dmso_pairwise_scores.columns = ["pearsons_correlation", "Metadata_treatment", "plate_well_0", "plate_well_1"]
@@ -159,27 +156,21 @@ consensus_dmso_neg_df = consensus_dmso_df.loc[
 
 
 # comparing the consensus profiles of the positive controls
-consensus_dmso_pos_cntrl_comparer = PairwiseCompareManager(
-    _df=consensus_dmso_pos_df,
-    _feat_cols=features,
-    _different_columns=["Metadata_plate_name"],
-    _same_columns=["Metadata_treatment"],
-    _comparator=PearsonsCorrelation(),
+consensus_pos_cntrl_pairwise_scores = pairwise_pearson(
+    profile=consensus_dmso_pos_df,
+    feat_cols=features,
+    different_cols=["Metadata_plate_name"],
+    same_cols=["Metadata_treatment"],
 )
 
 # comparing the consensus profiles of the negative controls
-consensus_dmso_neg_cntrl_comparer = PairwiseCompareManager(
-    _df=consensus_dmso_neg_df,
-    _feat_cols=features,
-    _different_columns=["Metadata_plate_name"],
-    _same_columns=["Metadata_treatment"],
-    _comparator=PearsonsCorrelation(),
+consensus_neg_cntrl_pairwise_scores = pairwise_pearson(
+    profile=consensus_dmso_neg_df,
+    feat_cols=features,
+    different_cols=["Metadata_plate_name"],
+    same_cols=["Metadata_treatment"],
 )
 
-# collecting all pairwise scores
-consensus_pos_cntrl_pairwise_scores = consensus_dmso_pos_cntrl_comparer()
-consensus_neg_cntrl_pairwise_scores = consensus_dmso_neg_cntrl_comparer()
-
 
 # In[9]:
 
@@ -222,29 +213,21 @@ final_consensus_pairwise_scores.to_csv(output_path / "final_dmso_consensus_pairw
 
 
 # selecting only the treated wells without the DMSO profiles
-treated_wells_only_df = agg_profile.loc[
-    (agg_profile["Metadata_treatment"] != "DMSO-positive") & (agg_profile["Metadata_treatment"] != "DMSO-negative")
-].copy()
-
-# reducing the metadata to only the relevant ones
-treated_wells_only_df = treated_wells_only_df[["Metadata_plate_name", "Metadata_treatment"] + features]
+# only the relevant metadata is kept since the features are already normalized
+treated_wells_only_df = agg_meta[["Metadata_plate_name", "Metadata_treatment"]].iloc[trt_idx]
 
 
 # In[ ]:
 
 
 # calculating the pairwise scores between replicates
-replicate_pairwise_comparer = PairwiseCompareManager(
-    _df=treated_wells_only_df,
-    _feat_cols=features,
-    _different_columns=["Metadata_plate_name"],
-    _same_columns=["Metadata_treatment"],
-    _comparator=PearsonsCorrelation(),
+replicate_pairwise_scores = pairwise_pearson_from_z(
+    z_feats=z_feats[trt_idx],
+    meta=treated_wells_only_df,
+    different_cols=["Metadata_plate_name"],
+    same_cols=["Metadata_treatment"],
 )
 
-# collecting all pairwise scores
-replicate_pairwise_scores = replicate_pairwise_comparer()
-
 
 # In[12]:
 
@@ -270,29 +253,23 @@ replicate_pairwise_scores.to_csv(output_path / "final_replicate_pairwise_scores.
 # In[13]:
 
 
+# both reference comparisons are computed one after the other, since each matrix
+# product already uses all the BLAS threads and running them concurrently would
+# oversubscribe the cores
 # calculating pairwise correlation between healthy control and treated failing wells
-healthy_ref_trt_pairwise_comparer = PairwiseCompareManager(
-    _df=agg_profile.loc[agg_profile["Metadata_treatment"] != "DMSO-negative"],
-    _feat_cols=features,
-    _different_columns=[
-        "Metadata_control_type",
-        "Metadata_treatment",
-    ],
-    _comparator=PearsonsCorrelation(),
+healthy_ref_trt_pairwise_scores = pairwise_pearson_from_z(
+    z_feats=z_feats[healthy_ref_idx],
+    meta=agg_meta.iloc[healthy_ref_idx],
+    different_cols=["Metadata_control_type", "Metadata_treatment"],
 )
 
 # calculating pairwise correlation between failing control and treated failing wells
-failing_ref_trt_pairwise_comparer = PairwiseCompareManager(
-    _df=agg_profile.loc[agg_profile["Metadata_treatment"] != "DMSO-positive"],
-    _feat_cols=features,
-    _different_columns=["Metadata_control_type", "Metadata_treatment"],
-    _comparator=PearsonsCorrelation(),
+failing_ref_trt_pairwise_scores = pairwise_pearson_from_z(
+    z_feats=z_feats[failing_ref_idx],
+    meta=agg_meta.iloc[failing_ref_idx],
+    different_cols=["Metadata_control_type", "Metadata_treatment"],
 )
 
-# collecting all pairwise scores
-healthy_ref_trt_pairwise_scores = healthy_ref_trt_pairwise_comparer()
-failing_ref_trt_pairwise_scores = failing_ref_trt_pairwise_comparer()
-
 
 # In[14]:
 
@@ -316,43 +293,46 @@ final_trt_pairwise_scores = (
     .reset_index(drop=True)
 )
 
-# Merge the combined dataframe with pathway information from pathway_df
-# This adds the Metadata_Pathway column to the final dataframe
-final_trt_pairwise_scores = final_trt_pairwise_scores.merge(
-    pathway_df, how="left", on="Metadata_treatment"
-).drop_duplicates()
-
-# Validate the correctness of the pathway information by comparing the merged data
-# with the original pathway dictionary (pathway_dict)
-final_trt_pairwise_pathways = dict(
-    zip(
-        final_trt_pairwise_scores["Metadata_treatment"],
-        final_trt_pairwise_scores["Metadata_Pathway"],
+# Add the pathway information from pathway_df with a treatment to pathway lookup,
+# each treatment has a single pathway so there is no need to merge all wells and
+# drop the duplicated rows afterwards
+pathway_map = pathway_df.drop_duplicates("Metadata_treatment").set_index(
+    "Metadata_treatment"
+)["Metadata_Pathway"]
+final_trt_pairwise_scores["Metadata_Pathway"] = final_trt_pairwise_scores[
+    "Metadata_treatment"
+].map(pathway_map)
+
+# Validate the correctness of the pathway information by comparing the mapped
+# pathways with the original pathways of each treatment in a single vectorized check
+final_trt_pairwise_pathways = final_trt_pairwise_scores.drop_duplicates(
+    "Metadata_treatment", keep="last"
+).set_index("Metadata_treatment")["Metadata_Pathway"]
+original_pathways = pathway_df.drop_duplicates(
+    "Metadata_treatment", keep="last"
+).set_index("Metadata_treatment")["Metadata_Pathway"]
+
+# all treatments must be found in the original pathway information
+missing_treatments = ~final_trt_pairwise_pathways.index.isin(original_pathways.index)
+if missing_treatments.any():
+    raise KeyError(
+        f"Treatments not found in pathway_df: {final_trt_pairwise_pathways.index[missing_treatments].tolist()}"
     )
+
+# pathways must match, where missing pathways in both are considered a match
+original_pathways = original_pathways.reindex(final_trt_pairwise_pathways.index)
+mismatched_pathways = (final_trt_pairwise_pathways != original_pathways) & ~(
+    final_trt_pairwise_pathways.isna() & original_pathways.isna()
 )
-pathway_dict = dict(
-    zip(
-        pathway_df["Metadata_treatment"],
-        pathway_df["Metadata_Pathway"],
+if mismatched_pathways.any():
+    raise ValueError(
+        f"Pathway mismatch for treatments: {final_trt_pairwise_pathways.index[mismatched_pathways].tolist()}"
     )
-)
-# Validate the correctness of the pathway information
-for treatment, merged_pathway in final_trt_pairwise_pathways.items():
-    original_pathway = pathway_dict.get(treatment)
-
-    if original_pathway is None:
-        raise KeyError("Key {treatment} not found in pathway_dict")
-    elif merged_pathway != original_pathway:
-        if pd.isna(merged_pathway) and pd.isna(original_pathway):
-            continue
-        raise ValueError(
-            f"Pathway mismatch for key {treatment}: {merged_pathway} != {original_pathway}"
-        )
 
 # If there are NaN values in the pathway column, fill them with "No Pathway"
 final_trt_pairwise_scores["Metadata_Pathway"] = final_trt_pairwise_scores[
     "Metadata_Pathway"
-].apply(lambda x: x if pd.notna(x) else "No Pathway")
+].fillna("No Pathway")
 
 # Save the final dataframe with pairwise scores and pathway information to a CSV file
 final_trt_pairwise_scores.to_csv(
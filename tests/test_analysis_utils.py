@@ -0,0 +1,197 @@
+"""
+Regression tests for the pairwise Pearson correlation helpers in analysis_utils.
+"""
+
+import itertools
+import pathlib
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# analysis_utils imports copairs at module level
+pytest.importorskip("copairs")
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+from utils import analysis_utils  # noqa: E402
+from utils.analysis_utils import normalize_profiles, pairwise_pearson_from_z  # noqa: E402
+
+EXPECTED_COLUMNS = [
+    "pearsons_correlation",
+    "Metadata_treatment__antehoc_group0",
+    "Metadata_treatment__antehoc_group1",
+    "Metadata_plate_name__posthoc_group0",
+    "Metadata_plate_name__posthoc_group1",
+]
+
+
+def test_pairwise_pearson_from_z_without_profiles():
+    """No profiles must return an empty result instead of calling BLAS."""
+    z_feats = np.zeros((0, 5), dtype=np.float32)
+    meta = pd.DataFrame(
+        {
+            "Metadata_treatment": pd.Series([], dtype=object),
+            "Metadata_plate_name": pd.Series([], dtype=object),
+        }
+    )
+
+    pairwise_scores = pairwise_pearson_from_z(
+        z_feats, meta, ["Metadata_plate_name"], ["Metadata_treatment"]
+    )
+
+    assert pairwise_scores.empty
+    assert pairwise_scores.columns.tolist() == EXPECTED_COLUMNS
+
+
+def test_pairwise_pearson_from_z_with_missing_groups():
+    """Profiles whose group values are all missing are dropped before any product."""
+    z_feats = np.random.default_rng(0).random((4, 5), dtype=np.float32)
+    meta = pd.DataFrame(
+        {
+            "Metadata_treatment": [np.nan] * 4,
+            "Metadata_plate_name": ["p1", "p2", "p3", "p4"],
+        }
+    )
+
+    pairwise_scores = pairwise_pearson_from_z(
+        z_feats, meta, ["Metadata_plate_name"], ["Metadata_treatment"]
+    )
+
+    assert pairwise_scores.empty
+    assert pairwise_scores.columns.tolist() == EXPECTED_COLUMNS
+
+
+def _profiles(meta, n_features=20, seed=0):
+    """Random profiles with the given metadata and CellProfiler-like feature names."""
+    feats = np.random.default_rng(seed).normal(size=(meta.shape[0], n_features))
+    feat_cols = [f"Cells_AreaShape_Feature{idx}" for idx in range(n_features)]
+    profile = pd.concat(
+        [meta.reset_index(drop=True), pd.DataFrame(feats, columns=feat_cols)], axis=1
+    )
+    return profile, feats, feat_cols
+
+
+def _brute_force_pairs(feats, meta, different_cols, same_cols):
+    """All selected pairs as (group0 values, group1 values, correlation) tuples, where
+    group0 holds the profile with the lowest value in the first different column."""
+    order_col = sorted(different_cols)[0]
+    group_cols = sorted(same_cols) + sorted(different_cols)
+    pairs = []
+    for idx0, idx1 in itertools.combinations(range(meta.shape[0]), 2):
+        row0, row1 = meta.iloc[idx0], meta.iloc[idx1]
+        if any(row0[col] != row1[col] for col in same_cols):
+            continue
+        if any(row0[col] == row1[col] for col in different_cols):
+            continue
+        if row0[order_col] > row1[order_col]:
+            idx0, idx1, row0, row1 = idx1, idx0, row1, row0
+        pairs.append(
+            (
+                tuple(row0[col] for col in group_cols),
+                tuple(row1[col] for col in group_cols),
+                np.corrcoef(feats[idx0], feats[idx1])[0, 1],
+            )
+        )
+    return sorted(pairs)
+
+
+def _scored_pairs(pairwise_scores, different_cols, same_cols):
+    """Pairwise scores as (group0 values, group1 values, correlation) tuples."""
+    pairwise_scores = pairwise_scores.rename(
+        columns=lambda col: col.replace("__antehoc", "").replace("__posthoc", "")
+    )
+    group_cols = sorted(same_cols) + sorted(different_cols)
+    return sorted(
+        zip(
+            zip(*(pairwise_scores[f"{col}_group0"] for col in group_cols)),
+            zip(*(pairwise_scores[f"{col}_group1"] for col in group_cols)),
+            pairwise_scores["pearsons_correlation"].astype(float),
+        )
+    )
+
+
+@pytest.fixture(params=[0, 10**9], ids=["pair_dot_products", "syrk"])
+def pairwise_path(request, monkeypatch):
+    """Forces the selected pairs to be computed either directly or with syrk, and
+    returns whether the direct path was used."""
+    monkeypatch.setattr(analysis_utils, "_PAIRWISE_DOT_RATIO", request.param)
+    calls = []
+    pair_dot_products = analysis_utils._pair_dot_products
+
+    def _recorded_pair_dot_products(*args, **kwargs):
+        calls.append(True)
+        return pair_dot_products(*args, **kwargs)
+
+    monkeypatch.setattr(analysis_utils, "_pair_dot_products", _recorded_pair_dot_products)
+    return request.param == 0, calls
+
+
+def test_pairwise_pearson_from_z_matches_brute_force(pairwise_path):
+    """Replicate pairs share the treatment and come from different plates."""
+    expects_pair_dot_products, calls = pairwise_path
+    meta = pd.DataFrame(
+        [
+            {"Metadata_treatment": treatment, "Metadata_plate_name": plate}
+            for treatment in ["UCD-3", "UCD-1", "UCD-2"]
+            for plate in ["plate_4", "plate_2", "plate_3", "plate_1"]
+        ]
+    ).sample(frac=1, random_state=0)
+    profile, feats, feat_cols = _profiles(meta)
+
+    pairwise_scores = pairwise_pearson_from_z(
+        normalize_profiles(profile, feat_cols),
+        profile,
+        different_cols=["Metadata_plate_name"],
+        same_cols=["Metadata_treatment"],
+    )
+
+    assert pairwise_scores.columns.tolist() == EXPECTED_COLUMNS
+    assert bool(calls) == expects_pair_dot_products
+
+    expected = _brute_force_pairs(
+        feats, profile, ["Metadata_plate_name"], ["Metadata_treatment"]
+    )
+    scored = _scored_pairs(pairwise_scores, ["Metadata_plate_name"], ["Metadata_treatment"])
+    assert [pair[:2] for pair in scored] == [pair[:2] for pair in expected]
+    np.testing.assert_allclose(
+        [pair[2] for pair in scored], [pair[2] for pair in expected], atol=1e-5
+    )
+
+
+def test_pairwise_pearson_from_z_reference_pairs(pairwise_path):
+    """Without same columns, reference wells are paired with every treated well and the
+    treated well is group1, which pairwise-compare relies on when it selects
+    'Metadata_treatment__posthoc_group1'."""
+    expects_pair_dot_products, calls = pairwise_path
+    meta = pd.DataFrame(
+        {
+            "Metadata_control_type": ["negative"] * 3 + ["trt"] * 5,
+            "Metadata_treatment": ["DMSO"] * 3 + [f"UCD-{idx}" for idx in range(5)],
+        }
+    ).sample(frac=1, random_state=1)
+    profile, feats, feat_cols = _profiles(meta, seed=1)
+    different_cols = ["Metadata_control_type", "Metadata_treatment"]
+
+    pairwise_scores = pairwise_pearson_from_z(
+        normalize_profiles(profile, feat_cols), profile, different_cols=different_cols
+    )
+
+    assert pairwise_scores.columns.tolist() == [
+        "pearsons_correlation",
+        "Metadata_control_type__antehoc_group0",
+        "Metadata_control_type__antehoc_group1",
+        "Metadata_treatment__posthoc_group0",
+        "Metadata_treatment__posthoc_group1",
+    ]
+    assert bool(calls) == expects_pair_dot_products
+    assert pairwise_scores.shape[0] == 3 * 5
+    assert (pairwise_scores["Metadata_treatment__posthoc_group0"] == "DMSO").all()
+    assert pairwise_scores["Metadata_treatment__posthoc_group1"].str.startswith("UCD").all()
+
+    expected = _brute_force_pairs(feats, profile, different_cols, [])
+    scored = _scored_pairs(pairwise_scores, different_cols, [])
+    assert [pair[:2] for pair in scored] == [pair[:2] for pair in expected]
+    np.testing.assert_allclose(
+        [pair[2] for pair in scored], [pair[2] for pair in expected], atol=1e-5
+    )
@@ -0,0 +1,33 @@
+"""
+Regression tests for the ranking helper in data_utils.
+"""
+
+import pathlib
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+from utils.data_utils import sort_by_rank  # noqa: E402
+
+
+@pytest.mark.parametrize("n_rows", [0, 1, 7, 49, 500])
+def test_sort_by_rank_matches_pandas_rank(n_rows):
+    """Ranks, rank dtype and the order of tied rows match Series.rank(method="max")
+    followed by sorting the ranks in descending order."""
+    rng = np.random.default_rng(n_rows)
+    map_df = pd.DataFrame(
+        {
+            "Metadata_treatment": [f"UCD-{idx}" for idx in range(n_rows)],
+            # few distinct values, so most rows are tied
+            "delta_mAP": rng.integers(-4, 5, n_rows) / 8,
+        }
+    )
+
+    expected = map_df.copy()
+    expected["rank"] = expected["delta_mAP"].rank(ascending=True, method="max")
+    expected = expected.sort_values(by="rank", ascending=False)
+
+    pd.testing.assert_frame_equal(sort_by_rank(map_df, "delta_mAP"), expected)
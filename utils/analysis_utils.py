@@ -5,13 +5,22 @@ this project.
 
 import pathlib
 
+import numpy as np
 import pandas as pd
 from copairs import map
-from copairs.matching import assign_reference_index
+from scipy.linalg.blas import get_blas_funcs
 
-from .data_utils import label_control_types, split_meta_and_features
+from .data_utils import (
+    as_feature_matrix,
+    label_control_types,
+    split_meta_and_features,
+)
 from .io_utils import load_config
 
+# pairs are computed directly instead of with a full matrix product when they are less
+# than 1/_PAIRWISE_DOT_RATIO of all the profile pairs
+_PAIRWISE_DOT_RATIO = 16
+
 
 def calculate_dmso_map_batch_profiles(
     batched_profiles: dict,
@@ -100,43 +109,41 @@ def calculate_dmso_map_batch_profiles(
             columns={"index": "original_index"}
         )
 
+        # Split metadata and feature columns for analysis, the features and the columns
+        # used to set the reference index are extracted once for all targeted plates
+        dmso_meta, dmso_feat_cols = split_meta_and_features(dmso_profile)
+        dmso_feats = as_feature_matrix(dmso_profile, dmso_feat_cols)
+        plate_barcodes = dmso_profile["Metadata_plate_barcode"].to_numpy()
+        pathways = dmso_profile["Metadata_Pathway"].to_numpy()
+        row_index = dmso_profile.index.to_numpy()
+
         # Iterate over control types to use them as references
         for ref_type in control_list:
 
             ap_scores = []  # Initialize list to store AP scores
+            is_ref_type = pathways == f"DMSO-{ref_type}"
 
             # Iterate over all targeted plate IDs
             for targeted_plate_id in plate_ids:
-                # Create a deep copy of the DMSO profile for manipulation
-                dmso_profile_w_target_plate = dmso_profile.copy(deep=True)
-
                 # Tag rows corresponding to the targeted plate
-                dmso_profile_w_target_plate["Metadata_targeted"] = (
-                    dmso_profile_w_target_plate["Metadata_plate_barcode"].apply(
-                        lambda plate_id: plate_id == targeted_plate_id
-                    )
-                )
+                is_targeted = plate_barcodes == targeted_plate_id
 
-                # set reference index for the targeted plate
+                # set reference index for the targeted plate, where the reference wells
+                # of the targeted plate keep their index and all other wells are set to
+                # -1 (same as copairs' assign_reference_index without copying the profile)
                 ref_col = "Metadata_reference_index"
-                dmso_profile_w_target_plate = assign_reference_index(
-                    df = dmso_profile_w_target_plate,
-                    condition= f"Metadata_targeted and Metadata_Pathway == 'DMSO-{ref_type}'",
-                    reference_col = ref_col,
-                    default_value = -1,
-                )
-
-                dmso_profile_w_target_plate["Metadata_reference_control_type"] = ref_type
-
-                # Split metadata and feature columns for analysis
-                dmso_meta, dmso_feats = split_meta_and_features(
-                    dmso_profile_w_target_plate
+                dmso_meta_w_target_plate = dmso_profile[dmso_meta].assign(
+                    Metadata_targeted=is_targeted,
+                    Metadata_reference_index=np.where(
+                        is_targeted & is_ref_type, row_index, -1
+                    ),
+                    Metadata_reference_control_type=ref_type,
                 )
 
                 # Compute average precision (AP) scores for the current setup
                 dmso_ap_scores = map.average_precision(
-                    meta=dmso_profile_w_target_plate[dmso_meta],
-                    feats=dmso_profile_w_target_plate[dmso_feats].values,
+                    meta=dmso_meta_w_target_plate,
+                    feats=dmso_feats,
                     pos_sameby=cntrl_copairs_ap_configs["pos_sameby"] + [ref_col],
                     pos_diffby=[],
                     neg_sameby=cntrl_copairs_ap_configs["neg_sameby"],
@@ -246,28 +253,32 @@ def calculate_trt_map_batch_profiles(
 
     # Iterate over each batch of loaded plate profiles
     for batch_id, profile in batched_profiles.items():
+        # Separate metadata columns from feature columns for downstream calculations,
+        # the features are extracted once as a contiguous float32 array since they are
+        # shared by all controls (copairs computes the similarities in float32)
+        ref_col = "Metadata_reference_index"
+        meta_columns, feature_columns = split_meta_and_features(profile)
+        meta_columns = [col for col in meta_columns if col != ref_col]
+        feats = as_feature_matrix(profile, feature_columns)
+        pathways = profile["Metadata_Pathway"].to_numpy()
+
         # Analyze the profile for each control condition
         for control_type, control_treatment, cell_state in control_list:
 
-            # Create a copy of the profile to preserve the original data
-            profile = profile.copy()
-
-            # Setting reference index for the reference control
-            ref_col = "Metadata_reference_index"
-            profile = assign_reference_index(df = profile,
-                                    condition = f"Metadata_Pathway == 'DMSO-{control_type}'",
-                                    reference_col = ref_col,
-                                    default_value = -1)
-
-            # Separate metadata columns from feature columns for downstream calculations
-            meta_columns, feature_columns = split_meta_and_features(profile)
+            # Setting reference index for the reference control, where the wells of the
+            # reference control keep their index and all other wells are set to -1
+            # (same as copairs' assign_reference_index without copying the profile)
+            ref_index = np.where(
+                pathways == f"DMSO-{control_type}", profile.index.to_numpy(), -1
+            )
+            meta = profile[meta_columns].assign(**{ref_col: ref_index})
 
             # Calculate average precision (AP) for the profile
             # Positive pairs are based on treatments with the same metadata
             # Negative pairs compare all DMSO-treated wells to all treatments
             replicate_aps = map.average_precision(
-                meta=profile[meta_columns],
-                feats=profile[feature_columns].values,
+                meta=meta,
+                feats=feats,
                 pos_sameby=copairs_ap_configs["pos_sameby"] + [ref_col],
                 pos_diffby=copairs_ap_configs["pos_diffby"],
                 neg_sameby=[],
@@ -307,3 +318,295 @@ def calculate_trt_map_batch_profiles(
                 save_map_path,
                 index=False,
             )
+
+
+def normalize_profiles(profile: pd.DataFrame, feat_cols: list[str]) -> np.ndarray:
+    """Mean-center and L2-normalize the features of each profile.
+
+    The dot product between two normalized profiles is their Pearson correlation,
+    therefore the normalized matrix can be computed once and reused across multiple
+    pairwise comparisons.
+
+    Parameters
+    ----------
+    profile : pd.DataFrame
+        Profiles containing metadata and morphological features.
+    feat_cols : list[str]
+        Feature columns to normalize.
+
+    Returns
+    -------
+    np.ndarray
+        float32 array of shape (n_profiles, n_features) with the normalized profiles.
+    """
+    # type checking
+    if not isinstance(profile, pd.DataFrame):
+        raise TypeError("'profile' must be a pandas DataFrame")
+    if not isinstance(feat_cols, list):
+        raise TypeError("'feat_cols' must be a list")
+
+    # the centered profiles are a new array, so the profile is never modified
+    feats = as_feature_matrix(profile, feat_cols)
+    z_feats = feats - feats.mean(axis=1, keepdims=True)
+    z_feats /= np.linalg.norm(z_feats, axis=1, keepdims=True)
+
+    return z_feats
+
+
+def pairwise_pearson(
+    profile: pd.DataFrame,
+    feat_cols: list[str],
+    different_cols: list[str],
+    same_cols: list[str] | None = None,
+    use_gpu: bool = False,
+) -> pd.DataFrame:
+    """Calculate Pearson correlations between pairs of profiles.
+
+    Profiles are normalized with `normalize_profiles` and then paired with
+    `pairwise_pearson_from_z`, which describes the pairing rules and the output.
+
+    Parameters
+    ----------
+    profile : pd.DataFrame
+        Profiles containing metadata and morphological features.
+    feat_cols : list[str]
+        Feature columns used to calculate the correlations.
+    different_cols : list[str]
+        Metadata columns where paired profiles must have different values.
+    same_cols : list[str] | None, optional
+        Metadata columns where paired profiles must have the same values. Default is
+        None.
+    use_gpu : bool, optional
+        If True, the correlations are computed on the GPU with CuPy, which must be
+        installed. Default is False.
+
+    Returns
+    -------
+    pd.DataFrame
+        Pairwise scores with a "pearsons_correlation" column and the group values of
+        both profiles in each pair.
+    """
+    return pairwise_pearson_from_z(
+        z_feats=normalize_profiles(profile, feat_cols),
+        meta=profile,
+        different_cols=different_cols,
+        same_cols=same_cols,
+        use_gpu=use_gpu,
+    )
+
+
+def _pair_dot_products(
+    z_feats: np.ndarray,
+    idx0: np.ndarray,
+    idx1: np.ndarray,
+    chunk_size: int = 4096,
+) -> np.ndarray:
+    """Compute the dot products between the rows of the given pairs of profiles.
+
+    The pairs are processed in chunks to bound the memory used by the gathered rows.
+
+    Parameters
+    ----------
+    z_feats : np.ndarray
+        Normalized profiles of shape (n_profiles, n_features).
+    idx0 : np.ndarray
+        Row indices of the first profile of each pair.
+    idx1 : np.ndarray
+        Row indices of the second profile of each pair.
+    chunk_size : int, optional
+        Number of pairs processed at once. Default is 4096.
+
+    Returns
+    -------
+    np.ndarray
+        Dot product of each pair.
+    """
+    dot_products = np.empty(idx0.shape[0], dtype=z_feats.dtype)
+    for start in range(0, idx0.shape[0], chunk_size):
+        stop = start + chunk_size
+        dot_products[start:stop] = np.einsum(
+            "ij,ij->i", z_feats[idx0[start:stop]], z_feats[idx1[start:stop]]
+        )
+
+    return dot_products
+
+
+def _gpu_pair_dot_products(
+    z_feats: np.ndarray, idx0: np.ndarray, idx1: np.ndarray
+) -> np.ndarray:
+    """Compute the dot products between the rows of the given pairs of profiles on
+    the GPU with CuPy.
+
+    The matrix product and the pair selection are done on the GPU, therefore only the
+    dot products of the selected pairs are transferred back to the host.
+
+    Parameters
+    ----------
+    z_feats : np.ndarray
+        Normalized profiles of shape (n_profiles, n_features).
+    idx0 : np.ndarray
+        Row indices of the first profile of each pair.
+    idx1 : np.ndarray
+        Row indices of the second profile of each pair.
+
+    Returns
+    -------
+    np.ndarray
+        Dot product of each pair.
+
+    Raises
+    ------
+    ImportError
+        If CuPy is not installed.
+    """
+    # CuPy is an optional dependency that is only required for the GPU path
+    try:
+        import cupy as cp
+    except ImportError as e:
+        raise ImportError(
+            "CuPy must be installed to compute correlations on the GPU"
+        ) from e
+
+    z_feats_gpu = cp.asarray(z_feats)
+    correlations = cp.matmul(z_feats_gpu, z_feats_gpu.T)
+
+    return cp.asnumpy(correlations[cp.asarray(idx0), cp.asarray(idx1)])
+
+
+def pairwise_pearson_from_z(
+    z_feats: np.ndarray,
+    meta: pd.DataFrame,
+    different_cols: list[str],
+    same_cols: list[str] | None = None,
+    use_gpu: bool = False,
+) -> pd.DataFrame:
+    """Calculate Pearson correlations between pairs of already normalized profiles.
+
+    Profiles are paired when they share the same values in all `same_cols` and have
+    different values in all `different_cols`. Since the profiles are mean-centered and
+    L2-normalized (see `normalize_profiles`), the Pearson correlation of all profile
+    pairs is a single symmetric matrix product. If only a small fraction of all pairs is
+    selected, only the dot products of the selected pairs are computed instead.
+
+    The output mirrors the scores generated by pairwise-compare's
+    `PairwiseCompareManager` with the `PearsonsCorrelation` comparator: `same_cols` are
+    labeled as "antehoc" groups and `different_cols` as "posthoc" groups. If no
+    `same_cols` are provided, the first (sorted) different column is labeled as the
+    "antehoc" group. Within a pair, group0 holds the profile with the lowest value in
+    the first (sorted) different column.
+
+    Parameters
+    ----------
+    z_feats : np.ndarray
+        Normalized profiles of shape (n_profiles, n_features).
+    meta : pd.DataFrame
+        Metadata of the normalized profiles, where each row matches a row in `z_feats`.
+    different_cols : list[str]
+        Metadata columns where paired profiles must have different values.
+    same_cols : list[str] | None, optional
+        Metadata columns where paired profiles must have the same values. Default is
+        None.
+    use_gpu : bool, optional
+        If True, the correlations are computed on the GPU with CuPy, which must be
+        installed. Default is False.
+
+    Returns
+    -------
+    pd.DataFrame
+        Pairwise scores with a "pearsons_correlation" column and the group values of
+        both profiles in each pair. The DataFrame is empty, with the same columns, if
+        no pairs are found.
+
+    Raises
+    ------
+    TypeError
+        If `z_feats` is not a numpy array, `meta` is not a pandas DataFrame, the
+        column arguments are not lists or `use_gpu` is not a boolean.
+    ValueError
+        If `z_feats` and `meta` have a different number of rows, or if no `same_cols`
+        are provided and there are less than two `different_cols`.
+    """
+    # type checking
+    if not isinstance(z_feats, np.ndarray):
+        raise TypeError("'z_feats' must be a numpy array")
+    if not isinstance(meta, pd.DataFrame):
+        raise TypeError("'meta' must be a pandas DataFrame")
+    if not isinstance(different_cols, list):
+        raise TypeError("'different_cols' must be a list")
+    if same_cols is None:
+        same_cols = []
+    if not isinstance(same_cols, list):
+        raise TypeError("'same_cols' must be a list")
+    if not isinstance(use_gpu, bool):
+        raise TypeError("'use_gpu' must be a boolean")
+    if z_feats.shape[0] != meta.shape[0]:
+        raise ValueError("'z_feats' and 'meta' must have the same number of rows")
+    if len(same_cols) == 0 and len(different_cols) < 2:
+        raise ValueError(
+            "At least two 'different_cols' are required if no 'same_cols' are provided"
+        )
+
+    # profiles with missing group values are not compared
+    same_cols = sorted(set(same_cols))
+    different_cols = sorted(set(different_cols))
+    has_groups = meta[same_cols + different_cols].notna().all(axis=1).to_numpy()
+    if not has_groups.all():
+        z_feats = z_feats[has_groups]
+        meta = meta.loc[has_groups]
+
+    # factorize the group labels once into sorted integer codes, so all the pair
+    # constraints are integer comparisons instead of object comparisons
+    group_codes = {
+        col: pd.factorize(meta[col], sort=True)[0] for col in same_cols + different_cols
+    }
+
+    # select the pairs that share all same columns and differ in all different columns
+    n_profiles = z_feats.shape[0]
+    pair_mask = np.ones((n_profiles, n_profiles), dtype=bool)
+    for col in same_cols:
+        pair_mask &= group_codes[col][:, None] == group_codes[col][None, :]
+    for col in different_cols:
+        pair_mask &= group_codes[col][:, None] != group_codes[col][None, :]
+
+    # keep each pair once by only using the upper triangle
+    idx0, idx1 = np.nonzero(np.triu(pair_mask, k=1))
+
+    # order each pair by the first different column, as pairwise-compare sorts groups
+    order_codes = group_codes[different_cols[0]]
+    swap = order_codes[idx0] > order_codes[idx1]
+    idx0, idx1 = np.where(swap, idx1, idx0), np.where(swap, idx0, idx1)
+
+    # the dot product of two normalized profiles is their Pearson correlation. When only
+    # a small fraction of all pairs is selected, computing the selected dot products is
+    # cheaper than the full matrix product. Without any pairs (e.g. no profiles are left
+    # after dropping missing group values) no product is computed, since BLAS rejects
+    # empty operands
+    if idx0.size == 0:
+        pair_correlations = np.empty(0, dtype=z_feats.dtype)
+    elif use_gpu:
+        pair_correlations = _gpu_pair_dot_products(z_feats, idx0, idx1)
+    elif idx0.shape[0] * _PAIRWISE_DOT_RATIO < n_profiles**2:
+        pair_correlations = _pair_dot_products(z_feats, idx0, idx1)
+    else:
+        # the correlation matrix is symmetric, therefore only its upper triangle is
+        # computed with a BLAS symmetric rank-k update. The transposed (Fortran ordered)
+        # view is passed to avoid copying the profiles
+        syrk = get_blas_funcs("syrk", (z_feats,))
+        correlations = syrk(alpha=1.0, a=z_feats.T, trans=1)
+        pair_correlations = correlations[
+            np.minimum(idx0, idx1), np.maximum(idx0, idx1)
+        ]
+
+    # collect the pairwise scores along with the group values of each pair
+    if len(same_cols) > 0:
+        antehoc_cols, posthoc_cols = same_cols, different_cols
+    else:
+        antehoc_cols, posthoc_cols = different_cols[:1], different_cols[1:]
+    pairwise_scores = {"pearsons_correlation": pair_correlations}
+    for group_type, group_cols in (("antehoc", antehoc_cols), ("posthoc", posthoc_cols)):
+        for col in group_cols:
+            group_values = meta[col].to_numpy()
+            pairwise_scores[f"{col}__{group_type}_group0"] = group_values[idx0]
+            pairwise_scores[f"{col}__{group_type}_group1"] = group_values[idx1]
+
+    return pd.DataFrame(pairwise_scores)
@@ -3,11 +3,14 @@ In this module, we have functions that has to do with providing utilities for
 the loaded profiles.
 """
 
+import functools
+import itertools
 import pathlib
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pandas as pd
 import pyarrow.parquet as pq
-from pycytominer.cyto_utils import infer_cp_features
 
 
 def split_meta_and_features(
@@ -32,23 +35,80 @@ def split_meta_and_features(
     -------
     tuple[List[str], List[str]]
         Tuple containing metadata and feature column names
+
+    Raises
+    ------
+    ValueError
+        If none of the columns start with the given compartment names
     """
 
-    # identify features names
-    features_cols = infer_cp_features(profile, compartments=compartments)
+    # the split only depends on the column names, therefore it is cached for profiles
+    # that share the same columns. Copies are returned so callers can modify them
+    meta_cols, features_cols = _split_column_names(
+        tuple(profile.columns), tuple(compartments), metadata_tag
+    )
+
+    return (list(meta_cols), list(features_cols))
+
+
+@functools.lru_cache(maxsize=32)
+def _split_column_names(
+    column_names: tuple[str, ...],
+    compartments: tuple[str, ...],
+    metadata_tag: bool | None,
+) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    """Cached helper of `split_meta_and_features` that splits the column names into
+    metadata and feature column names."""
+
+    # identify features names in a single pass over the column names, a column is a
+    # feature if it starts with one of the compartment names. str.startswith checks all
+    # compartment prefixes at once, without copying the names into a numpy string array
+    compartment_prefixes = tuple(compartment.title() for compartment in compartments)
+    is_feature = [name.startswith(compartment_prefixes) for name in column_names]
+
+    if not any(is_feature):
+        raise ValueError(
+            "No CP features found. Are you sure this dataframe is from CellProfiler?"
+        )
+    features_cols = tuple(itertools.compress(column_names, is_feature))
 
-    # iteratively search metadata features and retain order if the Metadata tag is not added
+    # metadata columns are all non-feature columns, retaining their order, if the
+    # Metadata tag is not added
     if metadata_tag is False:
-        meta_cols = [
-            colname
-            for colname in profile.columns.tolist()
-            if colname not in features_cols
-        ]
+        meta_cols = tuple(
+            itertools.compress(column_names, [not flag for flag in is_feature])
+        )
     else:
-        meta_cols = infer_cp_features(profile, metadata=metadata_tag)
+        meta_cols = tuple(
+            name for name in column_names if name.startswith("Metadata_")
+        )
 
     return (meta_cols, features_cols)
 
+def as_feature_matrix(profile: pd.DataFrame, feat_cols: list[str]) -> np.ndarray:
+    """Extracts the feature columns as a C-contiguous float32 array
+
+    pandas stores the features in column blocks, therefore `.values` may return an
+    upcasted or Fortran ordered array. This function returns a single row-major float32
+    buffer that can be passed to BLAS routines without hidden copies.
+
+    Parameters
+    ----------
+    profile : pd.DataFrame
+        Dataframe containing image-based profile
+    feat_cols : list[str]
+        feature column names to extract
+
+    Returns
+    -------
+    np.ndarray
+        C-contiguous float32 array of shape (n_profiles, n_features)
+    """
+    return np.asarray(
+        profile[feat_cols].to_numpy(copy=False), dtype=np.float32, order="C"
+    )
+
+
 def find_shared_features(profile_paths: list[str | pathlib.Path], delete_dups: bool | None =False) -> list[str]:
     """Find the shared features (columns) between the profiles in the provided list of
     file paths, while retaining the order of features as they appear in the first
@@ -81,27 +141,45 @@ def find_shared_features(profile_paths: list[str | pathlib.Path], delete_dups: b
         If any of the profile paths do not point to Parquet files.
     """
     # type checker to check if the file provided are parquet files
+    profile_paths = [pathlib.Path(path) for path in profile_paths]
     for path in profile_paths:
-        if not path.suffix == ".parquet" or path.suffix == ".pq":
+        if path.suffix not in {".parquet", ".pq"}:
             raise ValueError("All profile paths must point to Parquet files.")
 
+    # Extract column names from the arrow schemas without reading any data, the schemas
+    # are cached until the file is modified. The footers are read in parallel threads
+    # since reading them is bound by I/O latency, the results retain the order of paths
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(16, len(profile_paths)))
+    ) as executor:
+        loaded_column_names = list(
+            executor.map(
+                _profile_column_names,
+                profile_paths,
+            )
+        )
+
     # initialize the shared features to None
     shared_features = None
+    common_features = None
 
-    # iterate through the profile paths
-    for profile_path in profile_paths:
-        # Load the metadata of the Parquet file
-        parquet_metadata = pq.ParquetFile(profile_path)
-
-        # Extract column names from the schema
-        column_names = parquet_metadata.schema.names
-
+    # iterate through the column names of each profile
+    for column_names in loaded_column_names:
         if shared_features is None:
-            # Initialize shared features on the first iteration
+            # Initialize shared features on the first iteration, which sets the order
             shared_features = column_names
+            common_features = set(column_names)
         else:
-            # Retain only the features that are shared, keeping their order
-            shared_features = [name for name in shared_features if name in column_names]
+            # Retain only the features that are shared
+            common_features &= set(column_names)
+
+        # no need to check the remaining schemas if no features are shared
+        if not common_features:
+            return []
+
+    # Retain the shared features while keeping the order of the first profile
+    if shared_features is not None:
+        shared_features = [name for name in shared_features if name in common_features]
 
     # Remove duplicate column names if specified while retaining the order
     if delete_dups:
@@ -110,11 +188,25 @@ def find_shared_features(profile_paths: list[str | pathlib.Path], delete_dups: b
     return shared_features if shared_features else []
 
 
+@functools.lru_cache(maxsize=1024)
+def _parquet_column_names(path: str, mtime_ns: int) -> tuple[str, ...]:
+    """Cached helper of `find_shared_features` that reads the column names from the
+    footer metadata of a Parquet file, without creating a file reader. The modification
+    time is part of the cache key, so a modified file is read again."""
+    return tuple(pq.read_metadata(path).schema.names)
+
+
+def _profile_column_names(path: pathlib.Path) -> tuple[str, ...]:
+    """Module level helper of `find_shared_features` that is mapped over the profile
+    paths, keying the cached column names with the modification time of the file."""
+    return _parquet_column_names(str(path), path.stat().st_mtime_ns)
+
+
 def shuffle_features(profile: pd.DataFrame, seed: int = 0) -> pd.DataFrame:
     """Shuffle the values in the feature columns of a DataFrame while preserving metadata columns.
 
     This function separates the metadata and feature columns from the input DataFrame, shuffles
-    the values within each feature column independently using a specified random seed, and then
+    the values within each feature column using a specified random seed, and then
     concatenates the shuffled feature columns back with the metadata columns.
 
     Parameters:
@@ -144,14 +236,15 @@ def shuffle_features(profile: pd.DataFrame, seed: int = 0) -> pd.DataFrame:
     # Split metadata and feature columns
     meta_cols, feat_cols = split_meta_and_features(profile)
 
-    # Select only feature columns for shuffling
-    feats_df = profile[feat_cols].copy()
-
-    # Shuffle each feature column independently
-    for colname in feats_df.columns:
-        feats_df[colname] = (
-            feats_df[colname].sample(frac=1, random_state=seed).reset_index(drop=True)
-        )
+    # Shuffle the rows of all feature columns with the same seeded permutation, which is
+    # the permutation Series.sample(frac=1, random_state=seed) draws for each column.
+    # Indexing with the permutation returns a new array so the profile is not modified
+    perm = np.random.RandomState(seed).permutation(len(profile))
+    feats_df = pd.DataFrame(
+        profile[feat_cols].to_numpy()[perm],
+        columns=feat_cols,
+        index=profile.index,
+    )
 
     # Concatenate metadata and shuffled feature columns
     return pd.concat([profile[meta_cols], feats_df], axis=1)
@@ -198,3 +291,52 @@ def label_control_types(metadata_cell_type, heart_failure_type):
         return "negative"
     else:
         raise ValueError(f"Unknown combination added: {metadata_cell_type} {heart_failure_type}")
+
+
+def sort_by_rank(map_df: pd.DataFrame, value_column: str) -> pd.DataFrame:
+    """Sorts the dataframe from the highest to the lowest rank and adds a 'rank' column.
+
+    Values are ranked in ascending order, where tied values receive the highest rank of
+    their group. The ranks and the order of the sorted rows are the same as
+    `pandas.Series.rank(method="max")` followed by sorting the ranks in descending
+    order, but the ranks are derived from a single sort of the values.
+
+    Parameters
+    ----------
+    map_df : pd.DataFrame
+        DataFrame containing the values to rank.
+    value_column : str
+        Name of the column containing the values to rank.
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame sorted by rank in descending order with an additional 'rank' column.
+
+    Raises
+    ------
+    TypeError
+        Raised if 'map_df' is not a pandas dataframe or 'value_column' is not a string
+    """
+    # type checking
+    if not isinstance(map_df, pd.DataFrame):
+        raise TypeError("'map_df' must be a pandas dataframe")
+    if not isinstance(value_column, str):
+        raise TypeError("'value_column' must be a string")
+
+    values = map_df[value_column].to_numpy()
+    order = np.argsort(values, kind="stable")
+    sorted_values = values[order]
+
+    # in ascending order, a run of tied values shares the rank of its last position
+    is_run_end = np.ones(values.shape[0], dtype=bool)
+    is_run_end[:-1] = sorted_values[1:] != sorted_values[:-1]
+    run_end_ranks = np.flatnonzero(is_run_end) + 1
+    run_sizes = np.diff(run_end_ranks, prepend=0)
+
+    # ranks are stored as floats, the same as pandas.Series.rank
+    ranks = np.empty(values.shape[0], dtype=np.float64)
+    ranks[order] = np.repeat(run_end_ranks, run_sizes)
+
+    # sorting the ranks the same way as before keeps the order of the tied rows
+    return map_df.assign(rank=ranks).sort_values(by="rank", ascending=False)
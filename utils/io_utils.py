@@ -2,14 +2,27 @@
 
 This module will contain functions pertaining to loading and writing files.
 """
+import copy
+import functools
 import pathlib
 
+import pandas as pd
+import pyarrow.parquet as pq
 import yaml
 
+# use the C-accelerated YAML parser when PyYAML was built with libyaml
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 
 def load_config(fpath: str | pathlib.Path ) -> dict:
     """Loads in configuration file if specified path
 
+    Parsed configuration files are cached until the file is modified, a copy of the
+    cached contents is returned so callers can modify it.
+
     Parameters
     ----------
     fpath : str | pathlib.Path
@@ -31,5 +44,56 @@ def load_config(fpath: str | pathlib.Path ) -> dict:
     fpath = fpath.resolve(strict=True)
 
     # next is to load the yaml file
+    return copy.deepcopy(_load_yaml(str(fpath), fpath.stat().st_mtime_ns))
+
+
+@functools.lru_cache(maxsize=32)
+def _load_yaml(fpath: str, mtime_ns: int) -> dict:
+    """Cached helper of `load_config` that parses a YAML file. The modification time
+    is part of the cache key, so a modified file is parsed again."""
     with open(fpath) as content:
-        return yaml.safe_load(content)
+        return yaml.load(content, Loader=SafeLoader)
+
+
+def load_profile_columns(
+    fpath: str | pathlib.Path, columns: list[str] | None = None
+) -> pd.DataFrame:
+    """Loads in a parquet profile while only decoding the selected columns
+
+    The columns are pushed down to the parquet reader, so the unused columns are never
+    decoded. The file is memory mapped and the column chunks are pre-buffered, which
+    coalesces the many small column chunk reads into fewer large reads. The arrow table
+    is converted into pandas with the columns of each dtype consolidated into a single
+    block, since a frame with one block per column is slow to concatenate and to add
+    columns to.
+
+    Parameters
+    ----------
+    fpath : str | pathlib.Path
+        path pointing to the parquet profile
+    columns : list[str] | None, optional
+        column names to load, by default None which loads all columns
+
+    Returns
+    -------
+    pd.DataFrame
+        loaded profile with only the selected columns
+
+    Raises
+    ------
+    TypeError
+        Raised if 'fpath' is not a string or pathlib.Path object, or if 'columns' is
+        not a list
+    """
+
+    # type checking
+    if not isinstance(fpath, (str | pathlib.Path)):
+        raise TypeError("'fpath' must be a string or pathlib.Path object")
+    if columns is not None and not isinstance(columns, list):
+        raise TypeError("'columns' must be a list of column names")
+
+    # read only the selected columns with multiple threads and convert them into pandas
+    table = pq.ParquetFile(fpath, memory_map=True, pre_buffer=True).read(
+        columns=columns, use_threads=True, use_pandas_metadata=True
+    )
+    return table.to_pandas()